@@ -171,13 +171,18 @@ STRUCTURED_CHAT = StructuredChatWrapper(CHAT)
 SESSION_AGENTS = {}
 SESSION_MEMORY = {}
 
-def set_session_agent(session_key):
+def build_agent(model=STRUCTURED_CHAT):
+	"""Build an agent graph with its own checkpointer around the given chat model."""
 	memory = InMemorySaver()
 	agent = create_agent(
-		model=STRUCTURED_CHAT,
+		model=model,
 		system_prompt=SYSTEM_PROMPT,
 		checkpointer=memory,
 	)
+	return agent, memory
+
+def set_session_agent(session_key):
+	agent, memory = build_agent()
 	SESSION_AGENTS[session_key] = agent
 	SESSION_MEMORY[session_key] = memory
 
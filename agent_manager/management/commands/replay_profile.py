@@ -0,0 +1,324 @@
+"""
+Replay recorded conversations through the agent graph and profile each turn.
+
+The upstream model is replaced by a canned-response model, so the numbers only
+cover the local per-turn work: building the message list, LangGraph state
+handling and the prompt/Markdown assembly in ``StructuredChatWrapper``.
+
+Each line of the input JSONL file is one conversation:
+
+	{"id": "conv-1", "turns": [
+		{"message": "She don't like apples.", "mode": "grammar", "tone": "formal",
+		 "response": {"task_type": "correction", "original": "...", "output": "...", "explanation": "..."}}
+	]}
+
+``mode``, ``tone`` and ``response`` are optional. Without a recorded response
+the canned model echoes the message back as a correction.
+
+Timing is taken in ``--repeat`` uninstrumented passes; allocations and cProfile
+each get a pass of their own. No request reaches HuggingFace, but importing
+``agent_manager`` still needs a token variable set (any dummy value works).
+"""
+import cProfile
+import hashlib
+import json
+import statistics
+import time
+import tracemalloc
+import uuid
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from agent_manager import StructuredChatWrapper, build_agent, get_message_list
+
+
+SIZE_BUCKETS = [256, 1024, 4096]
+
+
+class CannedStructuredModel:
+	"""Stands in for the structured HuggingFace model and returns recorded responses."""
+
+	def __init__(self):
+		self.next_response = None
+
+	def invoke(self, input_text):
+		return self.next_response
+
+
+def canned_response(turn):
+	response = turn.get("response")
+	if response is not None:
+		return {
+			"original": response.get("original", turn["message"]),
+			"task_type": response.get("task_type", "correction"),
+			"output": response.get("output", ""),
+			"explanation": response.get("explanation", ""),
+		}
+	return {
+		"original": turn["message"],
+		"task_type": "correction",
+		"output": turn["message"],
+		"explanation": "",
+	}
+
+
+def load_conversations(path):
+	conversations = []
+	with open(path, encoding="utf-8") as f:
+		for line_no, line in enumerate(f, start=1):
+			if not line.strip():
+				continue
+			try:
+				conversation = json.loads(line)
+			except json.JSONDecodeError as exc:
+				raise CommandError(f"{path}:{line_no}: invalid JSON ({exc})")
+			if not isinstance(conversation, dict):
+				raise CommandError(f"{path}:{line_no}: each line must be a JSON object.")
+			turns = conversation.get("turns")
+			if not isinstance(turns, list) or not turns:
+				raise CommandError(f"{path}:{line_no}: \"turns\" must be a non-empty list.")
+			for turn in turns:
+				if not isinstance(turn, dict) or not isinstance(turn.get("message"), str) or not turn["message"]:
+					raise CommandError(f"{path}:{line_no}: every turn must be an object with a non-empty message.")
+				if turn.get("response") is not None and not isinstance(turn["response"], dict):
+					raise CommandError(f"{path}:{line_no}: \"response\" must be an object.")
+			conversation.setdefault("id", f"line-{line_no}")
+			conversations.append(conversation)
+
+	if not conversations:
+		raise CommandError(f"{path}: no conversations found.")
+	return conversations
+
+
+def recording_sha256(path):
+	return hashlib.sha256(Path(path).read_bytes()).hexdigest()
+
+
+def size_bucket(length):
+	for limit in SIZE_BUCKETS:
+		if length < limit:
+			return f"<{limit}"
+	return f">={SIZE_BUCKETS[-1]}"
+
+
+def summarize(values):
+	ordered = sorted(values)
+	return {
+		"mean": statistics.fmean(ordered),
+		"p50": statistics.median(ordered),
+		"p95": statistics.quantiles(ordered, n=20, method="inclusive")[18] if len(ordered) > 1 else ordered[0],
+		"max": ordered[-1],
+	}
+
+
+def group_means(samples, group_key, field):
+	groups = {}
+	for sample in samples:
+		groups.setdefault(group_key(sample), []).append(sample[field])
+	return {name: (len(values), statistics.fmean(values)) for name, values in groups.items()}
+
+
+class Command(BaseCommand):
+	help = "Replay recorded conversations through the agent graph with a canned model and profile per-turn overhead."
+
+	def add_arguments(self, parser):
+		parser.add_argument("recording", type=Path, help="JSONL file with one recorded conversation per line.")
+		parser.add_argument("--repeat", type=int, default=3, help="Timed passes over the recording (at least 3 when gating).")
+		parser.add_argument("--warmup", type=int, default=1, help="Conversations replayed before measuring.")
+		parser.add_argument("--no-allocations", action="store_true", help="Skip the tracemalloc pass.")
+		parser.add_argument("--profile-out", type=Path, help="Run a cProfile pass and write its stats here (load with pstats, snakeviz or flameprof).")
+		parser.add_argument("--max-turn-ms", type=float, help="Fail if the gated CPU time per turn exceeds this many milliseconds.")
+		parser.add_argument("--baseline", type=Path, help="Summary JSON from an earlier run to compare against.")
+		parser.add_argument("--max-regression", type=float, default=20.0, help="Allowed increase of the gated CPU time over the baseline, in percent.")
+		parser.add_argument("--save-summary", type=Path, help="Write this run's summary JSON here (usable as --baseline).")
+
+	def validate_options(self, options):
+		if options["repeat"] < 1:
+			raise CommandError("--repeat must be at least 1.")
+		for name in ("warmup", "max_regression", "max_turn_ms"):
+			if options[name] is not None and options[name] < 0:
+				raise CommandError(f"--{name.replace('_', '-')} must not be negative.")
+		if (options["baseline"] or options["max_turn_ms"] is not None) and options["repeat"] < 3:
+			raise CommandError("--repeat must be at least 3 when --baseline or --max-turn-ms is given.")
+
+	def handle(self, *args, **options):
+		self.validate_options(options)
+		conversations = load_conversations(options["recording"])
+
+		canned = CannedStructuredModel()
+		model = StructuredChatWrapper(canned)
+
+		self.run_pass(conversations[:options["warmup"]], model, canned)
+
+		# Timing passes run without any instrumentation; tracemalloc and cProfile
+		# hook every allocation or call and would swamp the numbers being gated.
+		passes = [self.run_pass(conversations, model, canned) for _ in range(options["repeat"])]
+
+		allocations = None
+		if not options["no_allocations"]:
+			tracemalloc.start()
+			try:
+				allocations = self.run_pass(conversations, model, canned, trace_allocations=True)
+			finally:
+				tracemalloc.stop()
+
+		if options["profile_out"]:
+			profiler = cProfile.Profile()
+			self.run_pass(conversations, model, canned, profiler=profiler)
+			profiler.dump_stats(options["profile_out"])
+			self.stdout.write(f"cProfile stats written to {options['profile_out']}")
+
+		summary = self.build_summary(passes, allocations, recording_sha256(options["recording"]))
+		self.report(summary)
+
+		if options["save_summary"]:
+			options["save_summary"].write_text(json.dumps(summary, indent=2), encoding="utf-8")
+			self.stdout.write(f"Summary written to {options['save_summary']}")
+
+		self.check_thresholds(summary, options)
+
+	def run_pass(self, conversations, model, canned, trace_allocations=False, profiler=None):
+		samples = []
+		for conversation in conversations:
+			samples.extend(self.replay(conversation, model, canned, trace_allocations, profiler))
+		return samples
+
+	def replay(self, conversation, model, canned, trace_allocations=False, profiler=None):
+		"""Replay one conversation on a fresh agent, the way the chat view drives a session."""
+		agent, _ = build_agent(model)
+		config = {"configurable": {"thread_id": str(uuid.uuid4())}}
+		samples = []
+
+		for index, turn in enumerate(conversation["turns"]):
+			canned.next_response = canned_response(turn)
+
+			if trace_allocations:
+				tracemalloc.reset_peak()
+				start_memory, _ = tracemalloc.get_traced_memory()
+			if profiler:
+				profiler.enable()
+			cpu_start = time.process_time()
+			wall_start = time.perf_counter()
+
+			messages = get_message_list(turn.get("mode", "default"), turn.get("tone", "default"), turn["message"])
+			result = agent.invoke({"messages": messages}, config=config)
+
+			wall = time.perf_counter() - wall_start
+			cpu = time.process_time() - cpu_start
+			if profiler:
+				profiler.disable()
+
+			if not result.get("messages"):
+				raise CommandError(f"Conversation {conversation['id']}, turn {index + 1}: agent returned no messages.")
+
+			sample = {
+				"turn": index + 1,
+				"size": len(turn["message"]),
+				"cpu_ms": cpu * 1000,
+				"wall_ms": wall * 1000,
+			}
+			if trace_allocations:
+				end_memory, peak_memory = tracemalloc.get_traced_memory()
+				sample["alloc_peak_kb"] = (peak_memory - start_memory) / 1024
+				sample["alloc_net_kb"] = (end_memory - start_memory) / 1024
+			samples.append(sample)
+
+		return samples
+
+	def build_summary(self, passes, allocations=None, recording=None):
+		"""Summarize the timing passes and, if given, the allocation pass samples.
+
+		``recording`` is the sha256 of the replayed file, saved so a baseline is
+		only ever compared against a run of the same recording.
+		"""
+		samples = [sample for samples in passes for sample in samples]
+		if not samples:
+			raise CommandError("No turns were replayed.")
+
+		summary = {
+			"recording_sha256": recording,
+			"turns": len(passes[0]),
+			"repeat": len(passes),
+			"cpu_ms": summarize([s["cpu_ms"] for s in samples]),
+			"wall_ms": summarize([s["wall_ms"] for s in samples]),
+			# Median of the per-pass p95s, so one noisy pass cannot fail the gate
+			"gate_cpu_ms": statistics.median(summarize([s["cpu_ms"] for s in p])["p95"] for p in passes),
+			"by_turn": {},
+			"by_size": {},
+		}
+		if allocations:
+			summary["alloc_peak_kb"] = summarize([s["alloc_peak_kb"] for s in allocations])
+			summary["alloc_net_kb"] = summarize([s["alloc_net_kb"] for s in allocations])
+
+		for key, group_key in (("by_turn", lambda s: str(s["turn"])), ("by_size", lambda s: size_bucket(s["size"]))):
+			for name, (count, cpu_ms) in group_means(samples, group_key, "cpu_ms").items():
+				summary[key][name] = {"count": count, "cpu_ms": cpu_ms}
+			if allocations:
+				for name, (_, alloc_peak_kb) in group_means(allocations, group_key, "alloc_peak_kb").items():
+					summary[key][name]["alloc_peak_kb"] = alloc_peak_kb
+
+		return summary
+
+	def report(self, summary):
+		def line(label, stats, unit):
+			return (
+				f"{label:<16} mean {stats['mean']:9.2f}  p50 {stats['p50']:9.2f}  "
+				f"p95 {stats['p95']:9.2f}  max {stats['max']:9.2f} {unit}"
+			)
+
+		self.stdout.write(f"Replayed {summary['turns']} turns x {summary['repeat']} timed passes")
+		self.stdout.write(line("CPU per turn", summary["cpu_ms"], "ms"))
+		self.stdout.write(line("Wall per turn", summary["wall_ms"], "ms"))
+		self.stdout.write(f"{'Gated CPU':<16} {summary['gate_cpu_ms']:.2f} ms (median of per-pass p95)")
+		if "alloc_peak_kb" in summary:
+			self.stdout.write(line("Peak alloc", summary["alloc_peak_kb"], "KiB"))
+			self.stdout.write(line("Net alloc", summary["alloc_net_kb"], "KiB"))
+
+		for key, title in (("by_turn", "By turn number"), ("by_size", "By message size (chars)")):
+			self.stdout.write(f"\n{title}:")
+			for name, entry in sorted(summary[key].items(), key=lambda item: self.group_order(key, item[0])):
+				text = f"  {name:>8}  n={entry['count']:<6} cpu {entry['cpu_ms']:9.2f} ms"
+				if "alloc_peak_kb" in entry:
+					text += f"  peak alloc {entry['alloc_peak_kb']:9.1f} KiB"
+				self.stdout.write(text)
+
+	@staticmethod
+	def group_order(key, name):
+		if key == "by_turn":
+			return int(name)
+		labels = [f"<{limit}" for limit in SIZE_BUCKETS] + [f">={SIZE_BUCKETS[-1]}"]
+		return labels.index(name)
+
+	def check_thresholds(self, summary, options):
+		gate = summary["gate_cpu_ms"]
+		failures = []
+
+		if options["max_turn_ms"] is not None and gate > options["max_turn_ms"]:
+			failures.append(f"CPU per turn {gate:.2f} ms exceeds the {options['max_turn_ms']:.2f} ms limit")
+
+		if options["baseline"]:
+			try:
+				baseline = json.loads(options["baseline"].read_text(encoding="utf-8"))
+				baseline_gate = float(baseline["gate_cpu_ms"])
+				baseline_recording = (baseline.get("recording_sha256"), baseline.get("turns"))
+			except (OSError, ValueError, TypeError, KeyError, AttributeError) as exc:
+				raise CommandError(f"Could not read baseline {options['baseline']}: {exc}")
+
+			if baseline_recording != (summary["recording_sha256"], summary["turns"]):
+				raise CommandError(
+					f"Baseline {options['baseline']} was saved from a different recording; "
+					"save a new baseline for this recording."
+				)
+
+			allowed = baseline_gate * (1 + options["max_regression"] / 100)
+			self.stdout.write(f"\nBaseline {baseline_gate:.2f} ms, allowed {allowed:.2f} ms, current {gate:.2f} ms")
+			if gate > allowed:
+				failures.append(
+					f"CPU per turn regressed from {baseline_gate:.2f} ms to {gate:.2f} ms "
+					f"(more than {options['max_regression']:.0f}%)"
+				)
+
+		if failures:
+			raise CommandError("; ".join(failures))
+		self.stdout.write(self.style.SUCCESS("Per-turn overhead within limits."))
@@ -0,0 +1,191 @@
+import json
+import tempfile
+from io import StringIO
+from pathlib import Path
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import SimpleTestCase
+
+from agent_manager import StructuredChatWrapper, build_agent
+from agent_manager.management.commands.replay_profile import (
+	CannedStructuredModel,
+	Command,
+	canned_response,
+	load_conversations,
+	size_bucket,
+	summarize,
+)
+
+
+class ReplayProfileHelpersTests(SimpleTestCase):
+	def setUp(self):
+		self.tmp = tempfile.TemporaryDirectory()
+		self.addCleanup(self.tmp.cleanup)
+
+	def write_recording(self, *lines):
+		path = Path(self.tmp.name) / "recording.jsonl"
+		path.write_text("\n".join(lines), encoding="utf-8")
+		return path
+
+	def options(self, **overrides):
+		options = {"repeat": 3, "warmup": 1, "max_turn_ms": None, "baseline": None, "max_regression": 20.0}
+		options.update(overrides)
+		return options
+
+	def test_load_conversations_accepts_valid_recording(self):
+		path = self.write_recording(
+			json.dumps({"turns": [{"message": "Hello"}]}),
+			"",
+			json.dumps({"id": "b", "turns": [{"message": "Hi", "response": {"output": "Hi"}}]}),
+		)
+		conversations = load_conversations(path)
+		self.assertEqual([c["id"] for c in conversations], ["line-1", "b"])
+
+	def test_load_conversations_rejects_malformed_lines(self):
+		bad_lines = [
+			"{not json",
+			json.dumps(["turns"]),
+			json.dumps("turns"),
+			json.dumps({"turns": "Hello"}),
+			json.dumps({"turns": []}),
+			json.dumps({"turns": ["Hello"]}),
+			json.dumps({"turns": [{"message": ""}]}),
+			json.dumps({"turns": [{"message": "Hi", "response": "Hi"}]}),
+		]
+		for line in bad_lines:
+			with self.subTest(line=line):
+				with self.assertRaisesRegex(CommandError, r"recording\.jsonl:1:"):
+					load_conversations(self.write_recording(line))
+
+	def test_load_conversations_rejects_empty_file(self):
+		with self.assertRaisesRegex(CommandError, "no conversations"):
+			load_conversations(self.write_recording("", ""))
+
+	def test_summarize_percentiles(self):
+		stats = summarize([float(v) for v in range(100, 0, -1)])
+		self.assertEqual(stats["p50"], 50.5)
+		self.assertAlmostEqual(stats["p95"], 95.05)
+		self.assertEqual(stats["max"], 100.0)
+		# 30 samples: round() half-to-even used to report 28.0, one rank low
+		self.assertAlmostEqual(summarize([float(v) for v in range(1, 31)])["p95"], 28.55)
+		self.assertEqual(summarize([3.0])["p95"], 3.0)
+
+	def test_canned_response(self):
+		recorded = {"task_type": "translation", "original": "Hi", "output": "Hola", "explanation": "Greeting."}
+		self.assertEqual(canned_response({"message": "Hi", "response": recorded}), recorded)
+		self.assertEqual(
+			canned_response({"message": "Hi"}),
+			{"original": "Hi", "task_type": "correction", "output": "Hi", "explanation": ""},
+		)
+		self.assertEqual(
+			canned_response({"message": "Hi", "response": {"output": "Hello"}}),
+			{"original": "Hi", "task_type": "correction", "output": "Hello", "explanation": ""},
+		)
+		self.assertEqual(
+			canned_response({"message": "Hi", "response": {}}),
+			{"original": "Hi", "task_type": "correction", "output": "", "explanation": ""},
+		)
+
+	def test_size_buckets_and_order(self):
+		self.assertEqual(size_bucket(0), "<256")
+		self.assertEqual(size_bucket(256), "<1024")
+		self.assertEqual(size_bucket(4096), ">=4096")
+		names = [">=4096", "<256", "<4096", "<1024"]
+		self.assertEqual(sorted(names, key=lambda n: Command.group_order("by_size", n)), ["<256", "<1024", "<4096", ">=4096"])
+		self.assertEqual(sorted(["10", "2", "1"], key=lambda n: Command.group_order("by_turn", n)), ["1", "2", "10"])
+
+	def test_build_summary_gates_on_median_of_pass_p95(self):
+		passes = [
+			[{"turn": 1, "size": 10, "cpu_ms": 1.0, "wall_ms": 1.0}],
+			[{"turn": 1, "size": 10, "cpu_ms": 50.0, "wall_ms": 50.0}],
+			[{"turn": 1, "size": 10, "cpu_ms": 2.0, "wall_ms": 2.0}],
+		]
+		summary = Command().build_summary(passes, recording="abc")
+		self.assertEqual(summary["gate_cpu_ms"], 2.0)
+		self.assertEqual(summary["recording_sha256"], "abc")
+		self.assertEqual(summary["by_turn"]["1"]["count"], 3)
+
+	def test_check_thresholds_absolute_limit(self):
+		command = Command(stdout=StringIO())
+		command.check_thresholds({"gate_cpu_ms": 4.0}, self.options(max_turn_ms=5.0))
+		with self.assertRaisesRegex(CommandError, "exceeds"):
+			command.check_thresholds({"gate_cpu_ms": 6.0}, self.options(max_turn_ms=5.0))
+
+	def test_check_thresholds_baseline_regression(self):
+		baseline = Path(self.tmp.name) / "baseline.json"
+		recording = {"recording_sha256": "abc", "turns": 4}
+		baseline.write_text(json.dumps({"gate_cpu_ms": 10.0, **recording}), encoding="utf-8")
+		command = Command(stdout=StringIO())
+		command.check_thresholds({"gate_cpu_ms": 11.9, **recording}, self.options(baseline=baseline))
+		with self.assertRaisesRegex(CommandError, "regressed"):
+			command.check_thresholds({"gate_cpu_ms": 12.1, **recording}, self.options(baseline=baseline))
+
+	def test_check_thresholds_rejects_baseline_from_other_recording(self):
+		baseline = Path(self.tmp.name) / "baseline.json"
+		baseline.write_text(json.dumps({"gate_cpu_ms": 10.0, "recording_sha256": "abc", "turns": 4}), encoding="utf-8")
+		command = Command(stdout=StringIO())
+		for summary in ({"recording_sha256": "def", "turns": 4}, {"recording_sha256": "abc", "turns": 5}):
+			with self.subTest(**summary):
+				with self.assertRaisesRegex(CommandError, "different recording"):
+					command.check_thresholds({"gate_cpu_ms": 1.0, **summary}, self.options(baseline=baseline))
+
+	def test_check_thresholds_unreadable_baseline(self):
+		baseline = Path(self.tmp.name) / "baseline.json"
+		baseline.write_text(json.dumps({"cpu_ms": {}}), encoding="utf-8")
+		with self.assertRaisesRegex(CommandError, "Could not read baseline"):
+			Command(stdout=StringIO()).check_thresholds({"gate_cpu_ms": 1.0}, self.options(baseline=baseline))
+
+	def test_validate_options(self):
+		command = Command()
+		command.validate_options(self.options())
+		invalid = [
+			{"repeat": 0},
+			{"warmup": -1},
+			{"max_regression": -5.0},
+			{"max_turn_ms": -1.0},
+			{"repeat": 2, "max_turn_ms": 5.0},
+			{"repeat": 1, "baseline": Path("baseline.json")},
+		]
+		for overrides in invalid:
+			with self.subTest(**overrides):
+				with self.assertRaises(CommandError):
+					command.validate_options(self.options(**overrides))
+
+
+class ReplayProfileCommandTests(SimpleTestCase):
+	def test_agent_keeps_history_across_turns(self):
+		canned = CannedStructuredModel()
+		agent, _ = build_agent(StructuredChatWrapper(canned))
+		config = {"configurable": {"thread_id": "test"}}
+
+		canned.next_response = canned_response({"message": "He go home.", "response": {"output": "He goes home."}})
+		agent.invoke({"messages": [{"role": "user", "content": "He go home."}]}, config=config)
+		canned.next_response = canned_response({"message": "Thanks", "response": {"task_type": "invalid", "output": "Welcome"}})
+		result = agent.invoke({"messages": [{"role": "user", "content": "Thanks"}]}, config=config)
+
+		contents = [m.content for m in result["messages"]]
+		self.assertEqual(len(contents), 4)
+		self.assertIn("**Correction**:  \nHe goes home.", contents[1])
+		self.assertEqual(contents[3], "Welcome")
+
+	def test_replay_smoke(self):
+		with tempfile.TemporaryDirectory() as tmp:
+			path = Path(tmp) / "recording.jsonl"
+			path.write_text("\n".join([
+				json.dumps({"id": "a", "turns": [
+					{"message": "She don't like apples.", "mode": "grammar", "tone": "formal"},
+					{"message": "Translate it to French.", "response": {"task_type": "translation", "output": "Elle n'aime pas les pommes."}},
+				]}),
+				json.dumps({"id": "b", "turns": [{"message": "Hello", "response": {"task_type": "invalid", "output": "Hi"}}]}),
+			]), encoding="utf-8")
+
+			out = StringIO()
+			call_command("replay_profile", str(path), "--repeat", "1", "--no-allocations", stdout=out)
+
+		output = out.getvalue()
+		self.assertIn("Replayed 3 turns x 1 timed passes", output)
+		by_turn = output.split("By turn number:")[1].split("By message size")[0]
+		self.assertRegex(by_turn, r"\s1\s+n=2\s")
+		self.assertRegex(by_turn, r"\s2\s+n=1\s")
+		self.assertIn("Per-turn overhead within limits.", output)